@@ -15,15 +15,23 @@
 #     You should have received a copy of the GNU Affero General Public
 #     License along with Ready Trader Go.  If not, see
 #     <https://www.gnu.org/licenses/>.
+import array
 import asyncio
 import itertools
-import statistics
+import logging
 
-from typing import List
-
-from scipy import stats
+from math import fabs, sqrt
+from typing import List, Tuple
 
 from ready_trader_go import BaseAutoTrader, Instrument, Lifespan, MAXIMUM_ASK, MINIMUM_BID, Side
+from ready_trader_go.messages import HEADER
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """Leave the decorated function as plain Python when numba is not installed."""
+        return lambda function: function
 
 
 LOT_SIZE = 10
@@ -31,6 +39,187 @@ POSITION_LIMIT = 93
 TICK_SIZE_IN_CENTS = 100
 MIN_BID_NEAREST_TICK = (MINIMUM_BID + TICK_SIZE_IN_CENTS) // TICK_SIZE_IN_CENTS * TICK_SIZE_IN_CENTS
 MAX_ASK_NEAREST_TICK = MAXIMUM_ASK // TICK_SIZE_IN_CENTS * TICK_SIZE_IN_CENTS
+#Plain int copies of the enum members used on every message, to skip the enum class lookups
+FUTURE = int(Instrument.FUTURE)
+BUY = int(Side.BUY)
+SELL = int(Side.SELL)
+GOOD_FOR_DAY = int(Lifespan.GOOD_FOR_DAY)
+HISTORY_LENGTH = 15
+AVERAGE_LENGTH = 7
+#Momentum is averaged over this many steps once the history is long enough
+GRADIENT_LENGTH = 5
+GRADIENT_SCALE = 1 / GRADIENT_LENGTH
+RSI_OVERBOUGHT = 75.0
+RSI_OVERSOLD = 25.0
+#How strongly the RSI scales the momentum, per RSI point
+RSI_MOMENTUM_SCALE = 0.8 / 100
+#Sum of x, and n * sum(x*x) - sum(x)**2, over x = 0, 1, ..., n-1 for every history length n
+SUM_X = tuple(n * (n - 1) // 2 for n in range(HISTORY_LENGTH + 1))
+SPREAD_X = tuple(n * n * (n * n - 1) // 12 for n in range(HISTORY_LENGTH + 1))
+
+
+def push_history(history: array.array, sums: List[int], head: int, n: int, value: int) -> None:
+    """Write a value into slot head of a history ring buffer of n values, keeping its regression sums up to date.
+
+    The sums are the total of y, y*y and x*y, where x is the position of the
+    value in the window, oldest first. Once the window is full the value in
+    slot head is the oldest, so it drops out and every remaining value moves
+    down one position.
+    """
+    if n == HISTORY_LENGTH:
+        oldest = history[head]
+        sums[0] -= oldest
+        sums[1] -= oldest * oldest
+        sums[2] -= sums[0]
+        n -= 1
+    sums[0] += value
+    sums[1] += value * value
+    sums[2] += n * value
+    history[head] = value
+
+
+@njit(cache=True)
+def linregress(n: int, sum_x: int, dx: int, sum_y: int, sum_yy: int,
+               sum_xy: int) -> Tuple[float, float, float, float]:
+    """Fit a line to n values at x = 0, 1, ..., n-1 from the sums kept by push_history.
+
+    The x side only depends on n, so sum_x and dx come from SUM_X[n] and
+    SPREAD_X[n], looked up once by the caller and shared by every series.
+
+    Return the slope, intercept, correlation coefficient and the standard
+    error of the slope, as scipy.stats.linregress would. The sums are exact
+    integers, so the results agree with scipy to within floating point
+    rounding (about 1e-10 relative for the standard error and far less for
+    the rest) while skipping its input checks, array conversion and
+    p-value.
+    """
+    dy = n * sum_yy - sum_y * sum_y
+    dxy = n * sum_xy - sum_x * sum_y
+    slope = dxy / dx
+    intercept = (sum_y - slope * sum_x) / n
+    r = dxy / sqrt(dx * dy) if dy != 0 else 0.0
+    r = min(max(r, -1.0), 1.0)
+    std_err = sqrt(max(1.0 - r * r, 0.0) * dy / dx / (n - 2)) if n > 2 else 0.0
+    return slope, intercept, r, std_err
+
+
+@njit(cache=True)
+def stdev(n: int, total: int, total_sq: int) -> float:
+    """Sample standard deviation of n values from their total and the total of their squares."""
+    return sqrt((n * total_sq - total * total) / (n * (n - 1)))
+
+
+@njit(cache=True)
+def update_rsi(history_mid: array.array, head: int, n: int, gain: float, loss: float) -> Tuple[float, float, float]:
+    """Advance the average gain and loss of the mid price and return the RSI with the new gain and loss.
+
+    The averages start from the ten moves into the newest mid price once there
+    are eleven prices, then decay by a tenth with each update. Until then the
+    RSI is -1 and gain and loss stay at -1.
+    """
+    if n <= 10:
+        return -1.0, gain, loss
+    vmid = history_mid[(head - 1) % HISTORY_LENGTH]
+    if gain == -1:
+        gtotal = 0
+        ltotal = 0
+        for i in range(2, 12):
+            diff = vmid - history_mid[(head - i) % HISTORY_LENGTH]
+            if diff > 0:
+                gtotal += diff
+            else:
+                ltotal -= diff
+        gain = gtotal / 10
+        loss = ltotal / 10
+    else:
+        diff = vmid - history_mid[(head - 2) % HISTORY_LENGTH]
+        if diff > 0:
+            gain = (gain * 9 + diff)/10
+            loss = (loss * 9)/10
+        else:
+            gain = (gain * 9)/10
+            loss = (loss * 9 - diff)/10
+    rs = gain/ loss
+    return 100 - 100/(1+rs), gain, loss
+
+
+@njit(cache=True)
+def compute_signals(history_vbid: array.array, history_vask: array.array, head: int, n: int,
+                    sum_vbid: int, sumsq_vbid: int, sumxy_vbid: int,
+                    sum_vask: int, sumsq_vask: int, sumxy_vask: int,
+                    sum_mid: int, sumsq_mid: int, sumxy_mid: int,
+                    recent_sum_vbid: int, recent_sumsq_vbid: int,
+                    recent_sum_vask: int, recent_sumsq_vask: int,
+                    rsi: float, best_bid: int, best_ask: int) -> Tuple[int, int, float, float, bool, bool]:
+    """Work out the next bid and ask prices from the n prices in the history ring buffers.
+
+    Follow the regression line when it fits the history closely, otherwise
+    the moving averages pushed along by the recent momentum, which the RSI
+    (or -1 before it is known) strengthens or damps. Then check each price
+    against a band around the mid price regression, or around the moving
+    average when the mid price does not follow a line. Return the new bid
+    price, the new ask price, the bid and ask momentum and whether the bid
+    and ask prices fall outside their bands.
+    """
+    recent_n = min(n, AVERAGE_LENGTH)
+    avg_vbid = recent_sum_vbid / recent_n
+    avg_vask = recent_sum_vask / recent_n
+
+    latest = (head - 1) % HISTORY_LENGTH
+    start = (head - min(n, 6)) % HISTORY_LENGTH
+    vbid = history_vbid[latest]
+    vask = history_vask[latest]
+    start_vbid = history_vbid[start]
+    start_vask = history_vask[start]
+
+    #Volume-weighted prices are always positive, so they can be divided by directly
+    per_step = GRADIENT_SCALE if n >= GRADIENT_LENGTH else 1 / n
+    grad_bid = (vbid - start_vbid) * per_step / start_vbid
+    grad_ask = (vask - start_vask) * per_step / start_vask
+
+    bslope, bintercept, br = 0.0, 0.0, 0.0
+    aslope, aintercept, ar = 0.0, 0.0, 0.0
+    mslope, mintercept, mr, mstd_err = 0.0, 0.0, 0.0, 0.0
+    if n >= 2:
+        sum_x = SUM_X[n]
+        dx = SPREAD_X[n]
+        bslope, bintercept, br, _ = linregress(n, sum_x, dx, sum_vbid, sumsq_vbid, sumxy_vbid)
+        aslope, aintercept, ar, _ = linregress(n, sum_x, dx, sum_vask, sumsq_vask, sumxy_vask)
+        mslope, mintercept, mr, mstd_err = linregress(n, sum_x, dx, sum_mid, sumsq_mid, sumxy_mid)
+
+    if rsi < 0:
+        bid_momentum = ask_momentum = 1.0
+    else:
+        bid_momentum = 1 + (RSI_OVERBOUGHT - rsi) * RSI_MOMENTUM_SCALE
+        ask_momentum = 1 + (rsi - RSI_OVERSOLD) * RSI_MOMENTUM_SCALE
+
+    if fabs(br) >= 0.8:
+        check_bid = bintercept + bslope * n
+    else:
+        check_bid = avg_vbid + avg_vbid * grad_bid * bid_momentum
+
+    if fabs(ar) >= 0.8:
+        check_ask = aintercept + aslope * n
+    else:
+        check_ask = avg_vask + avg_vask * grad_ask * ask_momentum
+
+    #Round down to a whole tick in integer arithmetic
+    bid = int(check_bid)
+    ask = int(check_ask)
+    new_bid_price = min(max(bid - bid % TICK_SIZE_IN_CENTS, 0), best_bid + TICK_SIZE_IN_CENTS) if best_bid != 0 else 0
+    new_ask_price = max(max(ask - ask % TICK_SIZE_IN_CENTS, 0), best_ask - TICK_SIZE_IN_CENTS) if best_ask != 0 else 0
+
+    deviation_bid = False
+    deviation_ask = False
+    if n >= 2:
+        if fabs(mr) > 0.55:
+            predict_mid = mintercept + mslope * n
+            deviation_bid = (predict_mid + mstd_err) <= new_bid_price
+            deviation_ask = new_ask_price <= (predict_mid - mstd_err)
+        else:
+            deviation_ask = new_ask_price <= (avg_vask - stdev(recent_n, recent_sum_vask, recent_sumsq_vask))
+            deviation_bid = (avg_vbid + stdev(recent_n, recent_sum_vbid, recent_sumsq_vbid)) <= new_bid_price
+    return new_bid_price, new_ask_price, grad_bid, grad_ask, deviation_bid, deviation_ask
 
 
 class AutoTrader(BaseAutoTrader):
@@ -44,17 +233,29 @@ class AutoTrader(BaseAutoTrader):
         """Initialise a new instance of the AutoTrader class."""
         super().__init__(loop, team_name, secret)
         self.order_ids = itertools.count(1)
-        self.bids = set()
-        self.asks = set()
+        self.orders = {}  #Side (BUY or SELL) of each live order, by client order id
         self.ask_id = self.ask_price = self.bid_id = self.bid_price = self.position = 0
-        #Store the last 10 average price for momentum
-        self.history_vbid = []
-        self.history_vask = []
-        self.history_mid = []
-        self.gain = -1 #Store average gain for RSI
-        self.loss = -1 #Store average loss for RSI
+        #Store the last 15 average price for momentum in ring buffers, the next one going in slot history_head
+        self.history_vbid = array.array("q", [0] * HISTORY_LENGTH)
+        self.history_vask = array.array("q", [0] * HISTORY_LENGTH)
+        self.history_mid = array.array("q", [0] * HISTORY_LENGTH)
+        self.history_head = 0
+        self.history_n = 0
+        #Totals of the last 7 average price, and of their squares, for the moving average
+        self.recent_sum_vbid = self.recent_sumsq_vbid = 0
+        self.recent_sum_vask = self.recent_sumsq_vask = 0
+        #Running sums of y, y*y and x*y over each history for the linear regressions
+        self.sums_vbid = [0, 0, 0]
+        self.sums_vask = [0, 0, 0]
+        self.sums_mid = [0, 0, 0]
+        self.gain = -1.0 #Store average gain for RSI
+        self.loss = -1.0 #Store average loss for RSI
         self.bid_ordered = 0
         self.ask_ordered = 0
+        #Best prices in the previous update, to spot updates that leave our orders as they are
+        self.last_best_bid = self.last_best_ask = 0
+        #Messages held back to go out together in one write, or None to send each straight away
+        self.pending_messages = None
 
     def on_error_message(self, client_order_id: int, error_message: bytes) -> None:
         """Called when the exchange detects an error.
@@ -63,7 +264,7 @@ class AutoTrader(BaseAutoTrader):
         will identify that order, otherwise the client_order_id will be zero.
         """
         self.logger.warning("error with order %d: %s", client_order_id, error_message.decode())
-        if client_order_id != 0 and (client_order_id in self.bids or client_order_id in self.asks):
+        if client_order_id != 0 and client_order_id in self.orders:
             self.on_order_status_message(client_order_id, 0, 0, 0)
 
     def on_hedge_filled_message(self, client_order_id: int, price: int, volume: int) -> None:
@@ -85,150 +286,99 @@ class AutoTrader(BaseAutoTrader):
         prices are reported along with the volume available at each of those
         price levels.
         """
-        self.logger.info("received order book for instrument %d with sequence number %d", instrument,
-                         sequence_number)
-        if instrument == Instrument.FUTURE:
-            if bid_prices[0] != 0:
-                vbid = 0
-                vask = 0
-                for i in range(1, 4):
-                    vbid += bid_prices[i] * bid_volumes[i]
-                    vask += ask_prices[i] * ask_volumes[i]
-                vbid = (vbid // sum(bid_volumes[1:4])) if bid_prices[0] != 0 else 0
-                vask = (vask // sum(ask_volumes[1:4])) if bid_prices[0] != 0 else 0
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("received order book for instrument %d with sequence number %d", instrument,
+                              sequence_number)
+        if instrument == FUTURE:
+            bv1, bv2, bv3 = bid_volumes[1], bid_volumes[2], bid_volumes[3]
+            av1, av2, av3 = ask_volumes[1], ask_volumes[2], ask_volumes[3]
+            bid_volume = bv1 + bv2 + bv3
+            ask_volume = av1 + av2 + av3
+            #The volume-weighted prices need volume on the second to fourth levels of both sides
+            if bid_prices[0] != 0 and bid_volume != 0 and ask_volume != 0:
+                vbid = (bid_prices[1] * bv1 + bid_prices[2] * bv2 + bid_prices[3] * bv3) // bid_volume
+                vask = (ask_prices[1] * av1 + ask_prices[2] * av2 + ask_prices[3] * av3) // ask_volume
                 vmid = (vbid + vask) // 2
 
                 
                 
-                self.history_vbid.append(vbid)
-                self.history_vask.append(vask)
-                self.history_mid.append(vmid)
-
-
-
-                over_bought_rsi = False
-                over_sold_rsi = False
-                rsi = -1
-
-                if len(self.history_vbid) > 15:
-                    self.history_vbid = self.history_vbid[-15:]
-                    self.history_vask = self.history_vask[-15:]
-                    self.history_mid = self.history_mid[-15:]
-                
-                if len(self.history_mid) > 10:
-                    if self.gain == -1:
-                        gtotal = 0
-                        ltotal = 0
-                        for i in range(-11, -1):
-                            diff = vmid - self.history_mid[i]
-                            if diff > 0:
-                                gtotal += diff
-                            else:
-                                ltotal += abs(diff)
-                        self.gain = gtotal / 10
-                        self.loss = ltotal / 10
-                    else:
-                        gain = 0
-                        loss = 0
-                        diff = vmid - self.history_mid[-2]
-                        if diff > 0:
-                            gain = diff
-                        else:
-                            loss = abs(diff)
-                        self.gain = (self.gain * 9 + gain)/10
-                        self.loss = (self.loss * 9 + loss)/10
-                    rs = self.gain/ self.loss
-                    rsi = 100 - 100/(1+rs)
-                    if rsi > 75:
-                        over_bought_rsi = True
-                    elif rsi < 25:
-                        over_sold_rsi = True
+                history_vbid = self.history_vbid
+                history_vask = self.history_vask
+                history_mid = self.history_mid
+                head = self.history_head
+                n = self.history_n
+
+                #The price leaving the last 7 is 7 slots behind head, wrapping round to the end of the ring
+                if n >= AVERAGE_LENGTH:
+                    oldest_vbid = history_vbid[head - AVERAGE_LENGTH]
+                    oldest_vask = history_vask[head - AVERAGE_LENGTH]
+                    self.recent_sum_vbid -= oldest_vbid
+                    self.recent_sum_vask -= oldest_vask
+                    self.recent_sumsq_vbid -= oldest_vbid * oldest_vbid
+                    self.recent_sumsq_vask -= oldest_vask * oldest_vask
+                self.recent_sum_vbid += vbid
+                self.recent_sum_vask += vask
+                self.recent_sumsq_vbid += vbid * vbid
+                self.recent_sumsq_vask += vask * vask
+
+                push_history(history_vbid, self.sums_vbid, head, n, vbid)
+                push_history(history_vask, self.sums_vask, head, n, vask)
+                push_history(history_mid, self.sums_mid, head, n, vmid)
+                head = self.history_head = (head + 1) % HISTORY_LENGTH
+                n = self.history_n = min(n + 1, HISTORY_LENGTH)
+
+                rsi, self.gain, self.loss = update_rsi(history_mid, head, n, self.gain, self.loss)
+                over_bought_rsi = rsi > RSI_OVERBOUGHT
+                over_sold_rsi = 0 <= rsi < RSI_OVERSOLD
+
+                #With both orders resting and the best prices unchanged there is nothing to
+                #re-price, so skip the calculation once the history has warmed up
+                best_bid = bid_prices[0]
+                best_ask = ask_prices[0]
+                unchanged = best_bid == self.last_best_bid and best_ask == self.last_best_ask
+                self.last_best_bid = best_bid
+                self.last_best_ask = best_ask
+                if unchanged and n >= 10 and self.bid_id != 0 and self.ask_id != 0:
+                    return
                                        
-                pre_end = len(self.history_vask) - 1
-                avg_vbid = 0
-                avg_vask = 0
-
-                for i in range(max(0, pre_end - 6), pre_end + 1):
-                    avg_vask += self.history_vask[i]
-                    avg_vbid += self.history_vbid[i]
-                avg_vask = avg_vask/max(1, min(7, pre_end+1))
-                avg_vbid = avg_vbid/max(1, min(7, pre_end+1))
-
-
-
-                start = max(0, pre_end - 5)
-                grad_bid = ((vbid - self.history_vbid[start])/ (min(len(self.history_vbid), 5)))/ max(self.history_vbid[start], 1)
-                grad_ask = ((vask - self.history_vask[start])/ (min(len(self.history_vask), 5)))/ max(self.history_vask[start], 1)
-
-                bslope, bintercept, br, bp, bstd_err = 0, 0, 0, 0, 0
-                aslope, aintercept, ar, ap, astd_err = 0, 0, 0, 0, 0
-                if len(self.history_vbid) >= 2:
-                    bslope, bintercept, br, bp, bstd_err = stats.linregress(list(range(len(self.history_vbid[-15:]))), self.history_vbid[-15:])
-                    aslope, aintercept, ar, ap, astd_err = stats.linregress(list(range(len(self.history_vask[-15:]))), self.history_vask[-15:])
-                
-                if abs(br) >= 0.8:
-                    check_bid = bintercept + bslope * len(self.history_vbid) 
-                else:
-                    if rsi == -1:
-                        check_bid = avg_vbid * (1 + grad_bid)
-                    else:
-                        check_bid = avg_vbid * (1 + grad_bid * (1 + (75 - rsi)/100 * 0.8))
-
-                if abs(ar) >= 0.8:
-                    check_ask = aintercept + aslope * len(self.history_vask) 
-                else:
-                    if rsi == -1:
-                        check_ask = avg_vask * (1 + grad_ask)
-                    else:
-                        check_ask = avg_vask * (1 + grad_ask * (1 + (rsi - 25)/100 * 0.8))
-
-                new_bid_price = min(max(int((check_bid)//TICK_SIZE_IN_CENTS * TICK_SIZE_IN_CENTS), 0), bid_prices[0] + TICK_SIZE_IN_CENTS) if bid_prices[0] != 0 else 0
-                new_ask_price = max(max(int((check_ask)//TICK_SIZE_IN_CENTS * TICK_SIZE_IN_CENTS), 0), ask_prices[0] - TICK_SIZE_IN_CENTS) if ask_prices[0] != 0 else 0
-
-
-                deviation_bid = False
-                deviation_ask = False
-
-                if len(self.history_vask) >= 2:                 
-                    mslope, mintercept, mr, mp, mstd_err = stats.linregress(list(range(len(self.history_mid[-15:]))), self.history_mid[-15:])
-                    
-                    if abs(mr) > 0.55:
-                        predict_mid = mintercept + mslope * len(self.history_mid)
-                        deviation_bid = (predict_mid + abs(mstd_err)) <= new_bid_price
-                        deviation_ask = new_ask_price <= (predict_mid - abs(mstd_err))
-                    else:
-                        predict_mid = -1
-                        if len(self.history_vask) >= 2:
-                            astd_err = statistics.stdev(self.history_vask[-7:])
-                            deviation_ask = new_ask_price <= (avg_vask - abs(astd_err))
-                        if len(self.history_vbid) >= 2:
-                            bstd_err = statistics.stdev(self.history_vbid[-7:])
-                            deviation_bid = (avg_vbid + abs(bstd_err)) <= new_bid_price 
-
-                if self.bid_id != 0 and new_bid_price != 0 and (new_bid_price > self.bid_price * (1+grad_bid) or new_bid_price < self.bid_price * (1-grad_bid)):
-                    self.send_cancel_order(self.bid_id)
-                    self.bid_id = 0
-                    self.bid_ordered = 10
-                if self.ask_id != 0 and new_ask_price != 0 and (new_bid_price > self.ask_price * (1+grad_ask) or new_bid_price < self.ask_price * (1-grad_ask)):
-                    self.send_cancel_order(self.ask_id)
-                    self.ask_id = 0
-                    self.ask_ordered = 10
-
-                
-                if self.bid_id == 0 and new_bid_price != 0 and (self.bid_ordered + self.position + LOT_SIZE) < POSITION_LIMIT and (not deviation_bid or not over_bought_rsi):
-                    self.bid_id = next(self.order_ids)
-                    self.bid_price = new_bid_price
-                    self.bid_ordered += LOT_SIZE
-                    self.send_insert_order(self.bid_id, Side.BUY, new_bid_price, LOT_SIZE, Lifespan.GOOD_FOR_DAY)
-                    self.bids.add(self.bid_id)
-                
-                
-                if self.ask_id == 0 and new_ask_price != 0 and (self.position - self.ask_ordered - LOT_SIZE) > (-1 * POSITION_LIMIT) and (not deviation_ask or not over_sold_rsi):
-                    self.ask_id = next(self.order_ids)
-                    self.ask_price = new_ask_price
-                    self.ask_ordered += LOT_SIZE
-                    self.send_insert_order(self.ask_id, Side.SELL, new_ask_price, LOT_SIZE, Lifespan.GOOD_FOR_DAY)
-                    self.asks.add(self.ask_id)
+                new_bid_price, new_ask_price, grad_bid, grad_ask, deviation_bid, deviation_ask = compute_signals(
+                    history_vbid, history_vask, head, n, *self.sums_vbid, *self.sums_vask, *self.sums_mid,
+                    self.recent_sum_vbid, self.recent_sumsq_vbid, self.recent_sum_vask, self.recent_sumsq_vask,
+                    rsi, best_bid, best_ask)
+
+                send_cancel_order = self.send_cancel_order
+                send_insert_order = self.send_insert_order
+                position = self.position
+
+                #Cancels go before inserts, and all of them leave in a single write
+                self.pending_messages = []
+                try:
+                    if self.bid_id != 0 and new_bid_price != 0 and (new_bid_price > self.bid_price * (1+grad_bid) or new_bid_price < self.bid_price * (1-grad_bid)):
+                        send_cancel_order(self.bid_id)
+                        self.bid_id = 0
+                        self.bid_ordered = 10
+                    if self.ask_id != 0 and new_ask_price != 0 and (new_bid_price > self.ask_price * (1+grad_ask) or new_bid_price < self.ask_price * (1-grad_ask)):
+                        send_cancel_order(self.ask_id)
+                        self.ask_id = 0
+                        self.ask_ordered = 10
+
+
+                    if self.bid_id == 0 and new_bid_price != 0 and (self.bid_ordered + position + LOT_SIZE) < POSITION_LIMIT and (not deviation_bid or not over_bought_rsi):
+                        self.bid_id = next(self.order_ids)
+                        self.bid_price = new_bid_price
+                        self.bid_ordered += LOT_SIZE
+                        send_insert_order(self.bid_id, BUY, new_bid_price, LOT_SIZE, GOOD_FOR_DAY)
+                        self.orders[self.bid_id] = BUY
+
+
+                    if self.ask_id == 0 and new_ask_price != 0 and (position - self.ask_ordered - LOT_SIZE) > (-1 * POSITION_LIMIT) and (not deviation_ask or not over_sold_rsi):
+                        self.ask_id = next(self.order_ids)
+                        self.ask_price = new_ask_price
+                        self.ask_ordered += LOT_SIZE
+                        send_insert_order(self.ask_id, SELL, new_ask_price, LOT_SIZE, GOOD_FOR_DAY)
+                        self.orders[self.ask_id] = SELL
+                finally:
+                    self.flush_messages()
 
     def on_order_filled_message(self, client_order_id: int, price: int, volume: int) -> None:
         """Called when one of your orders is filled, partially or fully.
@@ -239,14 +389,15 @@ class AutoTrader(BaseAutoTrader):
         """
         self.logger.info("received order filled for order %d with price %d and volume %d", client_order_id,
                          price, volume)
-        if client_order_id in self.bids:
+        side = self.orders.get(client_order_id)
+        if side == BUY:
             self.position += volume
             self.bid_ordered -= volume
-            self.send_hedge_order(next(self.order_ids), Side.ASK, MIN_BID_NEAREST_TICK, volume)
-        elif client_order_id in self.asks:
+            self.send_hedge_order(next(self.order_ids), SELL, MIN_BID_NEAREST_TICK, volume)
+        elif side == SELL:
             self.position -= volume
             self.ask_ordered -= volume
-            self.send_hedge_order(next(self.order_ids), Side.BID, MAX_ASK_NEAREST_TICK, volume)
+            self.send_hedge_order(next(self.order_ids), BUY, MAX_ASK_NEAREST_TICK, volume)
 
     def on_order_status_message(self, client_order_id: int, fill_volume: int, remaining_volume: int,
                                 fees: int) -> None:
@@ -267,9 +418,21 @@ class AutoTrader(BaseAutoTrader):
             elif client_order_id == self.ask_id:
                 self.ask_id = 0
 
-            # It could be either a bid or an ask
-            self.bids.discard(client_order_id)
-            self.asks.discard(client_order_id)
+            self.orders.pop(client_order_id, None)
+
+    def send_message(self, typ: int, data: bytes, length: int) -> None:
+        """Send a message, or hold it back while a batch is being gathered."""
+        if self.pending_messages is None:
+            super().send_message(typ, data, length)
+        else:
+            self.pending_messages.append(HEADER.pack(length, typ) + data)
+
+    def flush_messages(self) -> None:
+        """Send the messages held back since pending_messages was set in one write, and stop holding them."""
+        messages = self.pending_messages
+        self.pending_messages = None
+        if messages:
+            self._connection_transport.write(b"".join(messages))
 
     def on_trade_ticks_message(self, instrument: int, sequence_number: int, ask_prices: List[int],
                                ask_volumes: List[int], bid_prices: List[int], bid_volumes: List[int]) -> None:
@@ -282,5 +445,6 @@ class AutoTrader(BaseAutoTrader):
         If there are less than five prices on a side, then zeros will appear at
         the end of both the prices and volumes arrays.
         """
-        self.logger.info("received trade ticks for instrument %d with sequence number %d", instrument,
-                         sequence_number)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("received trade ticks for instrument %d with sequence number %d", instrument,
+                              sequence_number)